@@ -1,99 +1,152 @@
 import time
 import os
+import sys
 
-from numpy import spacing
+import numpy as np
+from numba import njit, prange
 
 from generate_tree_node import *
-from collections import defaultdict
+from itertools import combinations
 import matplotlib.pylab as plt
 
 
+@njit(cache=True)
+def count_items(data, n_items):
+    """
+    Count the occurrences of every item code in the flattened transactions.
+    :param data: Pass the item codes of all the transactions, flattened into one int32 array.
+    :param n_items: Pass the number of distinct item codes.
+    :return: Return an array with the count of each item code.
+    """
+    counts = np.zeros(n_items, dtype=np.int64)
+    for i in range(data.shape[0]):
+        counts[data[i]] += 1
+    return counts
+
+
+@njit(parallel=True, cache=True)
+def sort_transactions(data, offsets):
+    """
+    Sort each transaction of the flattened data in place, in increasing order of the rank, which is
+    decreasing order of the count. The transactions are independent, so they are sorted in parallel.
+    :param data: Pass the ranked items of all the transactions, flattened into one int32 array.
+    :param offsets: Pass the offsets of the transactions in data, transaction i is data[offsets[i]:offsets[i + 1]].
+    :return: None
+    """
+    for t in prange(offsets.shape[0] - 1):
+        data[offsets[t]:offsets[t + 1]].sort()
+
+
+@njit(cache=True)
+def filter_sort(data, offsets, counts, minimum_support):
+    """
+    1. Rank the item codes in decreasing order of the count.
+    2. Remove the items that do not meet the minimum support from each transaction.
+    3. Replace every remaining item with its rank and sort each transaction in increasing order of the rank,
+        which is decreasing order of the count, using sort_transactions.
+    :param data: Pass the item codes of all the transactions, flattened into one int32 array.
+    :param offsets: Pass the offsets of the transactions in data, transaction i is data[offsets[i]:offsets[i + 1]].
+    :param counts: Pass the count of each item code.
+    :param minimum_support: Pass the minimum support value.
+    :return: Return the flattened ranked transactions, their offsets and the item codes in rank order.
+    """
+    order = np.argsort(-counts, kind='mergesort')
+    rank = np.full(counts.shape[0], -1, dtype=np.int32)
+    for r in range(order.shape[0]):
+        if counts[order[r]] < minimum_support:
+            break
+        rank[order[r]] = r
+
+    ranked_data = np.empty_like(data)
+    ranked_offsets = np.zeros_like(offsets)
+    pos = 0
+    for t in range(offsets.shape[0] - 1):
+        for i in range(offsets[t], offsets[t + 1]):
+            if rank[data[i]] >= 0:
+                ranked_data[pos] = rank[data[i]]
+                pos += 1
+        ranked_offsets[t + 1] = pos
+
+    ranked_data = ranked_data[:pos]
+    sort_transactions(ranked_data, ranked_offsets)
+    return ranked_data, ranked_offsets, order
+
+
 def generate_freq_item_sets(input_transactions, minimum_support):
     """
     This function takes input transactions and minimum support:
-    1. Create item-sets each transaction and filters it out based on the minimum support value.
-    2. The Transaction list is then filtered and sorted based on the frequency of the items present in it.
+    1. Encode the items as ints and count them using count_items.
+    2. The Transaction list is then filtered and sorted based on the frequency of the items present in it
+        using filter_sort.
     3. Create a main/first FP tree based on the filtered transactions.
     4. Create a route table for each item based on the main FP tree.
     5. Create a conditional database for each item in the route table and return the frequent item sets
-    6. Call the conditional database function recursively for all the subtrees generated suing conditional DB.
+    6. Mine all the subtrees generated using conditional DB from an explicit work stack.
 
     :param input_transactions: Pass all the transactions from the input file. It is a list of items list.
     :param minimum_support: Ask user to give the desired minimum support value to calculate the freq items
     :return: Return the freq item sets with the frequency of occurrence.
     """
-    # Create item_sets dictionary and initiate all the values to zero
-    item_sets = defaultdict(lambda: 0)
-
-    # Fill the item set with all the values from the transactions
-    for txn in input_transactions:
-        for each_column in txn:
-            item_sets[each_column] += 1
-
-    temp_list = []
-    # Filter out all the items that do not meet the minimum support requirement.
-    for each_item, count in item_sets.items():
-        if int(count) >= minimum_support:
-            item_sets[each_item] = count
-        else:
-            temp_list.append(each_item)
-
-    for it in temp_list:
-        del item_sets[it]
-
-    def order_transactions(each_transaction):
-        """
-        1. This function will take transaction as an input and update it by removing
-            the infrequent items
-        2. It also sorts the items in the transaction in decreasing order of the count.
-        3. It will then return the filtered transaction.
-        :param each_transaction: Pass single transaction from the transaction list
-        :return: Return the sorted and filtered transaction
-        """
-        for each_element in each_transaction:
-            if each_element not in item_sets:
-                each_transaction.remove(each_element)
-        each_transaction = sorted(each_transaction, key=lambda v: item_sets[v], reverse=True)
-        return each_transaction
+    # Encode every item as an int code and flatten the transactions into one int32 array, with
+    # offsets marking where each transaction starts, so the preprocessing runs on numeric arrays.
+    offsets = np.zeros(len(input_transactions) + 1, dtype=np.int64)
+    np.cumsum([len(txn) for txn in input_transactions], out=offsets[1:])
+    codes = {}
+    data = np.fromiter((codes.setdefault(item, len(codes)) for txn in input_transactions for item in txn),
+                       dtype=np.int32, count=offsets[-1])
+
+    # Count the items, then filter out the items that do not meet the minimum support requirement
+    # and sort each transaction. The FP trees are keyed by the rank of the item in decreasing order
+    # of the count, and inv decodes the ranks back to the items.
+    counts = count_items(data, len(codes))
+    ranked_data, ranked_offsets, order = filter_sort(data, offsets, counts, minimum_support)
+    items = list(codes)
+    inv = [items[code] for code in order[:np.count_nonzero(counts >= minimum_support)].tolist()]
+    del data, offsets, counts, codes, items
 
     # Create the main FP tree using all the filtered transactions and name it as first_fp_tree.
     # Create a empty FR tree initially and add the all the transactions into the tree using
     # fp_tree.add() function
+    # Transactions are sliced out of the int32 buffer and converted one at a time, so only a single
+    # filtered list is alive at once.
+    ranked_offsets = ranked_offsets.tolist()
     first_fp_tree = fp_tree()
-    for transaction in list(map(order_transactions, input_transactions)):
-        first_fp_tree.append_items(transaction)
-
-    def conditional_db(tree, retrieved_list):
-        """
-        1. First we list all the items from the route table of the tree passed.
-        2. Calculate the current support of the nodes corresponding to the above items.
-        3. Check for the minimum support of the items.
-        4. If the items does not satisfy the minimum support, continue and check foe next item.
-        5. Else if items satisfy the minimum support, generate the parent paths of the item and
-            create a new conditional FP tree for the parent paths.
-        6. Call the conditional DB function for the new conditional FP tree recursively.
-        7. Return the frequent items for all the recursive calls.
-        :param tree: Pass the FP tree
-        :param retrieved_list: Pass the retrieved list
-        :return: return the frequency item sets
-        """
-        # get the items and nodes corresponding to each item in the route table.
-        for route_table_item, nodes in tree.get_items():
-            # get the current support for each item in the route table.
-            curr_support = 0
-            for n in nodes:
-                curr_support += n.count
-
-            # Check if the current support satisfies the minimum support value.
-            if curr_support < minimum_support or route_table_item in retrieved_list:
-                continue
-
-            # generate the parent paths of the item and
-            # create a new conditional FP tree for the parent paths.
-            else:
+    for t in range(len(input_transactions)):
+        first_fp_tree.append_items(ranked_data[ranked_offsets[t]:ranked_offsets[t + 1]].tolist())
+    # The ranked buffer is not needed while mining the trees.
+    del ranked_data, ranked_offsets
+
+    # Mine the trees from an explicit stack, starting with the first FP tree, instead of recursing.
+    # Each frame holds a tree, its retrieved list and an iterator over its route table, and is resumed
+    # one item at a time. Only the conditional FP tree of the current item is pushed on top of it, so
+    # the stack holds at most one conditional FP tree per level, like the recursive version did.
+    # For each item in the route table of the tree on top of the stack:
+    # 1. Calculate the current support of the nodes corresponding to the item.
+    # 2. If the item does not satisfy the minimum support, continue and check for next item.
+    # 3. Else generate the parent paths of the item and create a new conditional FP tree for them.
+    # 4. Push the new conditional FP tree onto the stack, and mine it before the next item.
+    # 5. Pop the tree once all the items in its route table are mined.
+    work = [(first_fp_tree, [], first_fp_tree.get_items())]
+    try:
+        while work:
+            tree, retrieved_list, route_items = work[-1]
+            # get the items and nodes corresponding to each item in the route table.
+            for route_table_item, nodes in route_items:
+                # get the current support for each item in the route table.
+                curr_support = sum(n._count for n in nodes)
+
+                # Check if the current support satisfies the minimum support value.
+                if curr_support < minimum_support or route_table_item in retrieved_list:
+                    continue
+
+                # generate the parent paths of the item and
+                # create a new conditional FP tree for the parent paths.
+
                 # Yield the frequent item sets with their current support to the caller.
+                # Decode the item ids back to the items before handing the item sets to the caller.
                 freq_item_set = [route_table_item] + retrieved_list
-                yield (freq_item_set, curr_support)
+                decoded_item_set = [inv[i] for i in freq_item_set]
+                yield decoded_item_set, curr_support
 
                 # Get all the prefix paths for the route table item using get_parent_paths() function
                 parent_paths = tree.get_parent_paths(route_table_item)
@@ -130,60 +183,97 @@ def generate_freq_item_sets(input_transactions, minimum_support):
                                 current_count = node.count
                             else:
                                 current_count = 0
-                            next_point = fp_node(cond_tree, node.item, current_count)
+                            next_point = fp_node.obtain(cond_tree, node.item, current_count)
                             tree_pointer.add_node(next_point)
                             # Update the node to the route table
                             cond_tree.revise_route_table(next_point)
                         tree_pointer = next_point
 
                 # Update the count for each node in the conditional FP tree.
-                for curr_path in cond_tree.get_parent_paths(cond_item):
-                    current_count = curr_path[-1].count
-                    # The count for the conditional item node is already updated above.
-                    for node in reversed(curr_path[:-1]):
-                        node._count += current_count
+                # List the nodes in pre-order, so every node comes after its parent, then walk the
+                # list backwards and add each node's count to its parent. Each node is visited once
+                # instead of once per prefix path running through it.
+                # The count for the conditional item nodes (the leaves) is already updated above.
+                pre_order = []
+                stack = list(cond_tree.root.children)
+                while stack:
+                    node = stack.pop()
+                    pre_order.append(node)
+                    stack.extend(node.children)
+                for node in reversed(pre_order):
+                    parent = node.parent
+                    if not parent.root:
+                        parent._count += node._count
+
+                # If the conditional FP tree is a single path, every combination of the items on
+                # the path is frequent, with the support of the lowest node in the combination.
+                # Emit the combinations directly instead of building a tree for each of them.
+                single_path = []
+                node = cond_tree.root
+                while len(node.children) == 1:
+                    node = node.children[0]
+                    single_path.append(node)
+                if node.leaf:
+                    path_items = [(n.item, n.count) for n in single_path
+                                  if n.count >= minimum_support and n.item not in freq_item_set]
+                    for size in range(1, len(path_items) + 1):
+                        for combination in combinations(path_items, size):
+                            yield ([inv[item] for item, _ in combination] + decoded_item_set,
+                                   min(count for _, count in combination))
+                    cond_tree.release()
+                    continue
+
+                # Push the conditional FP tree created above onto the work stack and mine it first.
+                # Note: This replaces the recursive call for every conditional FP tree created.
+                work.append((cond_tree, freq_item_set, cond_tree.get_items()))
+                break
+            else:
+                # All the items in the route table of the tree are mined, so return its nodes to the pool
+                # for the next conditional FP trees.
+                work.pop()
+                # The first FP tree is left out, as the pool is cleared right after it is mined.
+                if tree is not first_fp_tree:
+                    tree.release()
+    finally:
+        # Drop the pooled nodes so they are not held on to after mining is done, including when the
+        # caller stops consuming the item sets early.
+        fp_node.clear_pool()
 
-                # Call the conditional_db function for the conditional FP tree created above.
-                # Note: This method is called recursively for every conditional FP tree created.
-                for freq_sets in conditional_db(cond_tree, freq_item_set):
-                    yield freq_sets
 
-    for freq_item_sets in conditional_db(first_fp_tree, []):
-        yield freq_item_sets
+# Single figure and axes reused by all the plots, cleared before each one.
+fig, ax = plt.subplots()
 
 
 # Function to generate bar plots
-def bar_plot(dict, values, keys, x_label, y_label):
-    plt.bar(range(len(dict)), list(values), tick_label=list(keys))
-    xlocs, xlabs = plt.xticks()
-    plt.title(x_label + ' vs ' + y_label)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    for i, v in enumerate(values):
-        plt.text(xlocs[i] - 0.25, v + 0.01, str(v))
+def bar_plot(ax, values, keys, x_label, y_label):
+    ax.clear()
+    bars = ax.bar(range(len(values)), list(values), tick_label=list(keys))
+    ax.set_title(x_label + ' vs ' + y_label)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    ax.bar_label(bars)
     # plt.show()
-    plt.savefig(f'Outputs/{outfolder}/{y_label}.png')
-    plt.clf()
+    ax.figure.savefig(f'Outputs/{outfolder}/{y_label}.png')
 
 
 # Function to generate line plots
-def line_plot(keys, values, x_label, y_label):
-    plt.plot(keys, values, marker='x')
-    plt.title(x_label + ' vs ' + y_label)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
+def line_plot(ax, keys, values, x_label, y_label):
+    ax.clear()
+    ax.plot(list(keys), list(values), marker='x')
+    ax.set_title(x_label + ' vs ' + y_label)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
     # plt.show()
-    plt.savefig(f'Outputs/{outfolder}/{y_label}.png')
-    plt.clf()
+    ax.figure.savefig(f'Outputs/{outfolder}/{y_label}.png')
 
 
 
 if __name__ == "__main__":
     import csv
+    import heapq
+    import operator
     import tracemalloc
 
-    # Create an empty list of transactions.
-    transactions = []
     minsup = [100,200,500,700,1000,2000,5000,10000,15000]  # input('Enter Minimum support(value>2): ')
     dir = 'benchmarks/adult.csv'  # input("Enter directory Path(examples/filename.csv): ")
 
@@ -197,37 +287,28 @@ if __name__ == "__main__":
     if not os.path.exists(path):
         os.mkdir(path)
 
+    # Choose the delimiter once from the file name, page-blocks is separated by runs of whitespace.
     if dir == 'benchmarks/page-blocks.csv':
-        with open(dir) as csv_file:
-            for row in csv.reader(csv_file):
-                for i in row:
-                    i = " ".join(i.split()).split(' ')
-                    transactions.append(i)
+        sep = None
     elif dir == 'benchmarks/bank-additional-full.csv':
-        with open(dir) as csv_file:
-            for row in csv.reader(csv_file):
-                for i in row:
-                    i = ";".join(i.split()).split(';')
-                    transactions.append(i)
+        sep = ';'
     else:
-        with open(dir) as csv_file:
-            for row in csv.reader(csv_file):
-                if row:
-                    transactions.append(row)
-
-
-    # Removing the empty values from transactions
-    for item in transactions:
-        while '' in item:
-            item.remove('')
-        for i in item:
-            if '?' in i:
-                item.remove(i)
-            if '"' in i:
-                i=i.replace('"','')
+        sep = ','
+
+    # Read the file row by row, so transactions with different numbers of items are accepted.
+    # Strip the quotes, drop the empty and missing('?') values, and intern the items so equal
+    # items share one string object.
+    with open(dir) as csv_file:
+        rows = (line.split() for line in csv_file) if sep is None else csv.reader(csv_file, delimiter=sep)
+        transactions = [[sys.intern(c) for c in (cell.replace('"', '') for cell in row) if c and '?' not in c]
+                        for row in rows if row]
 
     print('Total Transactions from DataSet:', len(transactions), ' and attributes:', len(transactions[0]))
 
+    # Compile the Numba functions (or load them from the cache) once, so it is not counted in the time elapsed.
+    warm_up_data = np.zeros(1, dtype=np.int32)
+    filter_sort(warm_up_data, np.array([0, 1], dtype=np.int64), count_items(warm_up_data, 1), 1)
+
     # Calculating memory, time_elapsed, itemsets generated for each minimum support value
     time_elapsed = {}
     memory_usage = {}
@@ -238,12 +319,16 @@ if __name__ == "__main__":
         tracemalloc.start()
         for itemset, support in generate_freq_item_sets(transactions, int(minSupport)):
             result.append((itemset, support))
+        itemsets_generated[minSupport] = len(result)
 
-        result = sorted(result, key=lambda i: i[1], reverse=True)
+        # Sort by the support, or only keep the TOPK most frequent item sets if the TOPK env var is set.
+        if 'TOPK' in os.environ:
+            result = heapq.nlargest(int(os.environ['TOPK']), result, key=operator.itemgetter(1))
+        else:
+            result.sort(key=operator.itemgetter(1), reverse=True)
         tock = time.time()
         memory_usage[minSupport] = tracemalloc.get_traced_memory()[0]
         time_elapsed[minSupport] = round((tock - tick) * 1000, 2)
-        itemsets_generated[minSupport] = len(result)
         #print(result)
         with open(f"Outputs/{outfolder}/FreqItemsets_{minSupport}.csv", "w", newline="") as f:
             writer = csv.writer(f)
@@ -252,7 +337,7 @@ if __name__ == "__main__":
 
             writer.writerows(result)
 
-        print('Number of Frequent itemSets generated for minSupport', minSupport, len(result))
+        print('Number of Frequent itemSets generated for minSupport', minSupport, itemsets_generated[minSupport])
         print('\n')
 
 print('Minimum Supports', minsup)
@@ -279,12 +364,12 @@ with open(f'Outputs/{outfolder}/Tables_{table_path}.csv', 'w') as f:
     for key in itemsets_generated.keys():
         f.write("%s,%s\n" % (key, itemsets_generated[key]))
 
-bar_plot(time_elapsed, time_elapsed.values(), time_elapsed.keys(), 'Minimum Support', 'Time elapsed in ms')
-# bar_plot(memory_usage,memory_usage.values(),memory_usage.keys(),'Minimum Support','Memory Usage')
-bar_plot(itemsets_generated, itemsets_generated.values(), itemsets_generated.keys(), 'Minimum Support',
+bar_plot(ax, time_elapsed.values(), time_elapsed.keys(), 'Minimum Support', 'Time elapsed in ms')
+# bar_plot(ax,memory_usage.values(),memory_usage.keys(),'Minimum Support','Memory Usage')
+bar_plot(ax, itemsets_generated.values(), itemsets_generated.keys(), 'Minimum Support',
          'Itemsets Generated')
 
-line_plot(itemsets_generated.keys(), itemsets_generated.values(), 'Minimum support', 'Itemsets Generated(Line)')
-line_plot(memory_usage.keys(), memory_usage.values(), 'Minimum support', 'Memory Usage')
+line_plot(ax, itemsets_generated.keys(), itemsets_generated.values(), 'Minimum support', 'Itemsets Generated(Line)')
+line_plot(ax, memory_usage.keys(), memory_usage.values(), 'Minimum support', 'Memory Usage')
 
 print(f'Access the folder "Outputs/{outfolder}" for the FrequentItemsets generated, Tables and plots.')
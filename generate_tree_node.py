@@ -1,4 +1,12 @@
-from collections import namedtuple
+from collections import deque
+
+# Children are kept in a plain list until a node has more than this many of them,
+# after which they are promoted to a dict keyed by item.
+MAX_LIST_CHILDREN = 8
+
+# Free list of released fp_node objects, reused by fp_node.obtain() to avoid allocating new nodes
+# for every conditional FP tree.
+_node_pool = []
 
 
 class fp_tree(object):
@@ -10,16 +18,18 @@ class fp_tree(object):
     4. Nodes methods returns all the nodes of the item in the route table path.
     5. items methods returns all the items and their corresponding nodes in the route table.
     6. get_parent_paths method, returns the prefix path for the given node in an FP tree.
+    7. release method returns all the nodes of the FP tree to the node pool.
     """
-    Track = namedtuple("Track", "start end")
+    __slots__ = ('_root', '_route_head', '_route_tail')
 
     def __init__(self):
         """
         1. create a root node for the FP tree with null value.
-        2. Create empty route table
+        2. Create empty route table, as the first(head) and last(tail) node of the route for each item
         """
-        self._root = fp_node(self, None, None)
-        self._routes = {}
+        self._root = fp_node.obtain(self, None, None)
+        self._route_head = {}
+        self._route_tail = {}
 
     def get_parent_paths(self, item):
         """
@@ -29,12 +39,14 @@ class fp_tree(object):
         """
         parent_paths = []
         for node in self.get_nodes(item):
-            curr_path = []
+            # Build the path from the node up to the root, front-inserting so it reads root first.
+            curr_path = deque()
             while node and not node.root:
-                curr_path.append(node)
-                node = node.parent
-            curr_path.reverse()
-            parent_paths = [curr_path] + parent_paths
+                curr_path.appendleft(node)
+                node = node._parent
+            parent_paths.append(list(curr_path))
+        # Paths are collected in route order; reverse once to return them last node first.
+        parent_paths.reverse()
         return parent_paths
 
     def append_items(self, item_list):
@@ -69,14 +81,14 @@ class fp_tree(object):
 
         :return: None
         """
-        try:
-            # find the route to the current item
-            route = self._routes[curr_ptr.item]
+        # find the end of the route to the current item
+        tail = self._route_tail.get(curr_ptr.item)
+        if tail is None:
+            self._route_head[curr_ptr.item] = self._route_tail[curr_ptr.item] = curr_ptr
+        else:
             # add the node to te route in the route table
-            route[1].adjacent_item = curr_ptr
-            self._routes[curr_ptr.item] = self.Track(route[0], curr_ptr)
-        except KeyError:
-            self._routes[curr_ptr.item] = self.Track(curr_ptr, curr_ptr)
+            tail.adjacent_item = curr_ptr
+            self._route_tail[curr_ptr.item] = curr_ptr
 
     def get_nodes(self, item):
         """
@@ -84,12 +96,15 @@ class fp_tree(object):
         :param item: Pass the item to return the corresponding nodes of it.
         :return: Return the nodes corresponding to the item passed from the route table
         """
-        try:
-            # Find the first node in the route table
-            node = self._routes[item][0]
-        except KeyError:
-            return
+        # Find the first node in the route table
+        return self._walk(self._route_head.get(item))
 
+    @staticmethod
+    def _walk(node):
+        """
+        :param node: Pass the first node of a route
+        :return: Return the node and all its neighbor nodes along the route
+        """
         while node:
             yield node
             # look for all the neighbor nodes in the route.
@@ -99,9 +114,32 @@ class fp_tree(object):
         """
         :return: Returns all the items in the route table along with corresponding nodes
         """
-        for item in self._routes.keys():
+        # Snapshot the route table once, so no view into it is held while the caller mines the items.
+        items = tuple(self._route_head.items())
+        for item, head in items:
             # yield the item along with the corresponding nodes
-            yield item, self.get_nodes(item)
+            yield item, self._walk(head)
+
+    def release(self):
+        """
+        Push all the nodes of the FP tree back into the node pool, once the tree is no longer needed.
+        The tree is empty afterwards and must not be used again.
+        :return: None
+        """
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if type(node._children) is dict:
+                stack.extend(node._children.values())
+                node._children = []
+            else:
+                stack.extend(node._children)
+                node._children.clear()
+            node._tree = node._parent = node._adjacent_item = None
+            _node_pool.append(node)
+        self._root = None
+        self._route_head.clear()
+        self._route_tail.clear()
 
     @property
     def root(self):
@@ -118,7 +156,9 @@ class fp_node(object):
         the rest with empty values.
     2. add_node method will add the node to the child of the current node
     3. Find method returns the node if it is present in the child branch.
+    4. obtain method returns a node from the node pool, or a new node if the pool is empty.
     """
+    __slots__ = ('_tree', '_data_point', '_count', '_parent', '_children', '_adjacent_item')
 
     def __init__(self, tree, data_point, count=1):
         """
@@ -131,16 +171,49 @@ class fp_node(object):
         self._data_point = data_point
         self._count = count
         self._parent = None
-        self._children = {}
+        self._children = []
         self._adjacent_item = None
 
+    @classmethod
+    def obtain(cls, tree, data_point, count=1):
+        """
+        Reuse a released node from the node pool if there is one, else create a new node.
+        :param tree: Pass the tree for which this node belongs to.
+        :param data_point: Pass the item value of the node
+        :param count: pass the count corresponding to the item.
+        :return: Return the node, reset with the values passed
+        """
+        if not _node_pool:
+            return cls(tree, data_point, count)
+        node = _node_pool.pop()
+        # The parent, children and neighbor node were already reset when the node was released.
+        node._tree = tree
+        node._data_point = data_point
+        node._count = count
+        return node
+
+    @staticmethod
+    def clear_pool():
+        """
+        Drop all the released nodes held by the node pool.
+        :return: None
+        """
+        _node_pool.clear()
+
     def add_node(self, child):
         """
-        :param child:
-        :return:
+        1. Adds the child node to the children of the current node if the item is not already present.
+        2. Promotes the children list to a dict once the node has more than MAX_LIST_CHILDREN children.
+        :param child: pass the node to be added as a child
+        :return: None
         """
-        if child.item not in self._children:
-            self._children[child.item] = child
+        if self.find(child.item) is None:
+            if type(self._children) is dict:
+                self._children[child.item] = child
+            else:
+                self._children.append(child)
+                if len(self._children) > MAX_LIST_CHILDREN:
+                    self._children = {node.item: node for node in self._children}
             child.parent = self
 
     def find(self, item):
@@ -150,10 +223,12 @@ class fp_node(object):
         :param item: pass the item to find it in the child branch.
         :return: returns the node corresponds to the item if it in the child branch.
         """
-        try:
-            return self._children[item]
-        except:
-            return None
+        if type(self._children) is dict:
+            return self._children.get(item)
+        for child in self._children:
+            if child._data_point is item or child._data_point == item:
+                return child
+        return None
 
     @property
     def tree(self):
@@ -205,7 +280,9 @@ class fp_node(object):
         This method returns all the children corresponding to the node
         :return: Return the tuple with all the children values.
         """
-        return tuple(self._children.values())
+        if type(self._children) is dict:
+            return tuple(self._children.values())
+        return tuple(self._children)
 
     @property
     def adjacent_item(self):